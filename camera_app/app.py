@@ -18,33 +18,180 @@ Fecha: 2024
 """
 
 import json
+import os
 import cv2
+import queue
 import threading
 import time
 from flask import Flask, render_template, Response
 from datetime import datetime
 
+from config_loader import load_config
+
+try:
+    # libjpeg-turbo (SIMD) para codificar JPEG directamente desde BGR
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+except ImportError:
+    TurboJPEG = None
+
+try:
+    # WebSocket para enviar JPEG como mensajes binarios (menos overhead que MJPEG)
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
+
+JPEG_QUALITY = 85
+
+# Delimitadores multipart MJPEG (constantes, se envían por separado del JPEG)
+MJPEG_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+MJPEG_END = b'\r\n'
+
+# Aceleración por hardware para decodificar RTSP (NVDEC/VAAPI/QuickSync/D3D11)
+HW_ACCELERATION = {
+    'none': 'VIDEO_ACCELERATION_NONE',
+    'any': 'VIDEO_ACCELERATION_ANY',
+    'd3d11': 'VIDEO_ACCELERATION_D3D11',
+    'vaapi': 'VIDEO_ACCELERATION_VAAPI',
+    'mfx': 'VIDEO_ACCELERATION_MFX',
+}
+
 
 class CameraStream:
     """Clase para manejar el streaming de una cámara RTSP."""
     
-    def __init__(self, camera_config):
+    # Atributos fijos: acceso más rápido en el bucle de captura y los clientes
+    __slots__ = (
+        'camera_id', 'camera_name', 'rtsp_url', 'hw_acceleration', 'yuv_capture',
+        'preview_width', 'cpu_slot', 'cap', '_latest', 'frame_cond', '_frame_queue',
+        'running', 'thread', 'encode_thread', '_tj', '_yuv_shape',
+    )
+    
+    def __init__(self, camera_config, cpu_slot=None):
         """
         Inicializar stream de cámara.
         
         Args:
             camera_config (dict): Configuración de la cámara
+            cpu_slot (int): Posición para fijar los hilos a CPUs (None = sin fijar)
         """
         self.camera_id = camera_config['id']
         self.camera_name = camera_config['name']
         self.rtsp_url = camera_config['rtsp_url']
+        self.hw_acceleration = camera_config.get('hw_acceleration', 'any')
+        self.yuv_capture = camera_config.get('yuv_capture', False)
+        self.preview_width = camera_config.get('preview_width')  # None = resolución original
+        self.cpu_slot = cpu_slot
         self.cap = None
-        self.last_frame = None
-        self.last_frame_time = 0
-        self.frame_lock = threading.Lock()
+        self._yuv_shape = None  # Forma I420 esperada (alto * 3 / 2, ancho) de la captura actual
+        # Último frame publicado: (frame_id, jpeg, frame, timestamp). Se reemplaza
+        # la tupla completa en una sola asignación, así los lectores no necesitan lock
+        self._latest = (0, None, None, 0)
+        self.frame_cond = threading.Condition()  # Solo para despertar clientes en espera
+        # Último frame decodificado pendiente de codificar (siempre el más reciente)
+        self._frame_queue = queue.Queue(maxsize=1)
         self.running = False
         self.thread = None
+        self.encode_thread = None
+        self._tj = self._create_jpeg_encoder()
+    
+    @property
+    def last_frame(self):
+        """numpy.ndarray: Último frame capturado, o None."""
+        return self._latest[2]
+    
+    @property
+    def last_frame_time(self):
+        """float: Timestamp del último frame capturado (0 si no hay)."""
+        return self._latest[3]
+    
+    def _create_jpeg_encoder(self):
+        """
+        Crear codificador TurboJPEG si está disponible.
+        
+        Returns:
+            TurboJPEG: Codificador, o None para usar cv2.imencode
+        """
+        if TurboJPEG is None:
+            return None
+        try:
+            return TurboJPEG()
+        except Exception as e:
+            # La librería nativa libjpeg-turbo puede no estar instalada
+            print(f"⚠️  TurboJPEG no disponible, usando OpenCV: {e}")
+            return None
+    
+    def _encode_jpeg(self, frame):
+        """
+        Codificar un frame como JPEG.
+        
+        Acepta frames BGR (alto, ancho, 3) o YUV I420 planar (alto * 3 / 2, ancho).
+        Con I420 y TurboJPEG se evita la conversión YUV -> BGR -> YCbCr.
+        
+        Args:
+            frame (numpy.ndarray): Frame BGR o I420
+            
+        Returns:
+            bytes: Imagen JPEG, o None si falló la codificación
+        """
+        is_yuv = frame.ndim == 2
+        
+        if self._tj is not None:
+            if is_yuv:
+                height, width = frame.shape[0] * 2 // 3, frame.shape[1]
+                return self._tj.encode_from_yuv(frame, height, width,
+                                                quality=JPEG_QUALITY,
+                                                jpeg_subsample=TJSAMP_420)
+            return self._tj.encode(frame, quality=JPEG_QUALITY,
+                                   pixel_format=TJPF_BGR,
+                                   jpeg_subsample=TJSAMP_420)
+        
+        if is_yuv:
+            frame = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)
+        ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        return buffer.tobytes() if ret else None
+        
+    def _resize_for_preview(self, frame):
+        """
+        Reducir el frame al ancho de previsualización configurado.
+        
+        La grabación no se ve afectada (usa su propio proceso FFmpeg). Los
+        frames I420 planares se dejan sin cambios.
+        
+        Args:
+            frame (numpy.ndarray): Frame decodificado
+            
+        Returns:
+            numpy.ndarray: Frame reducido, o el mismo si no hace falta
+        """
+        if not self.preview_width or frame.ndim != 3 or frame.shape[1] <= self.preview_width:
+            return frame
         
+        scale = self.preview_width / frame.shape[1]
+        return cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    
+    def _open_capture(self):
+        """
+        Abrir el stream RTSP, intentando decodificación por hardware primero.
+        
+        Returns:
+            cv2.VideoCapture: Captura abierta (o no, si falló la conexión)
+        """
+        accel_name = HW_ACCELERATION.get(self.hw_acceleration, 'VIDEO_ACCELERATION_NONE')
+        accel = getattr(cv2, accel_name, cv2.VIDEO_ACCELERATION_NONE)
+        
+        if accel != cv2.VIDEO_ACCELERATION_NONE:
+            # Los frames siguen llegando como BGR en memoria del sistema
+            cap = cv2.VideoCapture(self.rtsp_url, cv2.CAP_FFMPEG,
+                                   [cv2.CAP_PROP_HW_ACCELERATION, accel])
+            if cap.isOpened():
+                if cap.get(cv2.CAP_PROP_HW_ACCELERATION) != cv2.VIDEO_ACCELERATION_NONE:
+                    print(f"⚡ Decodificación por hardware activa en {self.camera_name}")
+                return cap
+            cap.release()
+            print(f"⚠️  Sin decodificación por hardware en {self.camera_name}, usando CPU")
+        
+        return cv2.VideoCapture(self.rtsp_url)
+    
     def _connect_camera(self):
         """Conectar a la cámara RTSP."""
         try:
@@ -55,12 +202,22 @@ class CameraStream:
             print(f"🔗 URL: {self.rtsp_url}")
             
             # Configurar OpenCV para RTSP
-            self.cap = cv2.VideoCapture(self.rtsp_url)
+            self.cap = self._open_capture()
             self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Reducir buffer para menor latencia
+            self._yuv_shape = None
+            if self.yuv_capture:
+                # Pedir frames I420 sin convertir a BGR (si el backend lo soporta)
+                self.cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
             
             if not self.cap.isOpened():
                 raise Exception("No se pudo abrir la conexión RTSP")
             
+            if self.yuv_capture:
+                height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                if height > 0 and width > 0:
+                    self._yuv_shape = (height * 3 // 2, width)
+            
             print(f"✅ Conectado a {self.camera_name}")
             return True
             
@@ -69,7 +226,7 @@ class CameraStream:
             return False
     
     def _capture_frames(self):
-        """Hilo para capturar fotogramas continuamente."""
+        """Hilo para capturar (decodificar) fotogramas continuamente."""
         while self.running:
             try:
                 if self.cap is None or not self.cap.isOpened():
@@ -80,9 +237,10 @@ class CameraStream:
                 ret, frame = self.cap.read()
                 
                 if ret:
-                    with self.frame_lock:
-                        self.last_frame = frame
-                        self.last_frame_time = time.time()
+                    if frame.ndim == 2 and frame.shape != self._yuv_shape:
+                        self._disable_yuv_capture(frame.shape)
+                        continue
+                    self._queue_frame(frame, time.time())
                 else:
                     print(f"⚠️  Error leyendo frame de {self.camera_name}")
                     self.cap.release()
@@ -96,35 +254,171 @@ class CameraStream:
                     self.cap = None
                 time.sleep(5)
     
+    def _disable_yuv_capture(self, shape):
+        """
+        Volver a BGR si el backend no entrega frames I420 completos.
+        
+        Algunos backends (ej: FFmpeg en OpenCV 4.12) devuelven solo el plano Y
+        con CAP_PROP_CONVERT_RGB=0; codificarlo como I420 daría un JPEG corrupto.
+        
+        Args:
+            shape (tuple): Forma del frame recibido
+        """
+        print(f"⚠️  {self.camera_name} no entrega I420 (frame {shape}, esperado "
+              f"{self._yuv_shape}); usando BGR")
+        self.yuv_capture = False
+        # Reconectar sin CAP_PROP_CONVERT_RGB=0
+        self.cap.release()
+        self.cap = None
+    
+    def _queue_frame(self, frame, frame_time):
+        """
+        Entregar un frame al hilo de codificación descartando el pendiente.
+        
+        Args:
+            frame (numpy.ndarray): Frame decodificado
+            frame_time (float): Timestamp de captura
+        """
+        try:
+            self._frame_queue.put_nowait((frame, frame_time))
+        except queue.Full:
+            # El codificador va atrasado: reemplazar el frame viejo por el nuevo
+            try:
+                self._frame_queue.get_nowait()
+            except queue.Empty:
+                pass
+            self._frame_queue.put_nowait((frame, frame_time))
+    
+    def _encode_frames(self):
+        """Hilo para codificar y publicar frames, en paralelo con la captura."""
+        while self.running:
+            try:
+                frame, frame_time = self._frame_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            
+            try:
+                frame = self._resize_for_preview(frame)
+                # Codificar una sola vez por frame, compartido por todos los clientes
+                jpeg = self._encode_jpeg(frame)
+            except Exception as e:
+                print(f"❌ Error codificando frame de {self.camera_name}: {e}")
+                continue
+            
+            # Solo se reasignan referencias: cap.read() entrega un array nuevo
+            # en cada llamada y nunca se modifica tras publicarlo, así que
+            # los lectores pueden usarlo sin .copy(). Este hilo es el único
+            # escritor, por lo que la asignación de la tupla es la publicación atómica.
+            frame_id = self._latest[0] + 1
+            self._latest = (frame_id, jpeg, frame, frame_time)
+            with self.frame_cond:
+                self.frame_cond.notify_all()
+    
     def start(self):
-        """Iniciar captura de frames."""
+        """Iniciar captura y codificación de frames."""
         if not self.running:
             self.running = True
             self.thread = threading.Thread(target=self._capture_frames, daemon=True)
+            self.encode_thread = threading.Thread(target=self._encode_frames, daemon=True)
             self.thread.start()
+            self.encode_thread.start()
+            if self.cpu_slot is not None:
+                self._pin_threads()
             print(f"🎥 Iniciado streaming para {self.camera_name}")
     
+    def _pin_threads(self):
+        """
+        Fijar los hilos de captura y codificación a CPUs contiguas (solo Linux).
+        
+        Evita que el planificador los migre entre núcleos (caché L1/L2 fría) y
+        los marca como SCHED_BATCH para reducir las expropiaciones.
+        """
+        if not hasattr(os, 'sched_setaffinity'):
+            return
+        
+        cpus = sorted(os.sched_getaffinity(0))
+        capture_cpu = cpus[(2 * self.cpu_slot) % len(cpus)]
+        encode_cpu = cpus[(2 * self.cpu_slot + 1) % len(cpus)]
+        
+        for thread, cpu in ((self.thread, capture_cpu), (self.encode_thread, encode_cpu)):
+            try:
+                os.sched_setaffinity(thread.native_id, {cpu})
+                os.sched_setscheduler(thread.native_id, os.SCHED_BATCH, os.sched_param(0))
+            except OSError as e:
+                print(f"⚠️  No se pudo fijar CPU {cpu} para {self.camera_name}: {e}")
+                return
+        print(f"📌 {self.camera_name}: captura en CPU {capture_cpu}, codificación en CPU {encode_cpu}")
+    
     def stop(self):
         """Detener captura de frames."""
         self.running = False
         if self.thread:
             self.thread.join(timeout=2)
+        if self.encode_thread:
+            self.encode_thread.join(timeout=2)
         if self.cap:
             self.cap.release()
             self.cap = None
         print(f"🛑 Detenido streaming para {self.camera_name}")
     
-    def get_frame(self):
+    def wait_for_jpeg(self, last_id, timeout=1.0):
         """
-        Obtener el último frame capturado.
+        Esperar a que se publique un frame posterior a last_id.
         
+        Args:
+            last_id (int): ID del último frame entregado al cliente
+            timeout (float): Tiempo máximo de espera en segundos
+            
         Returns:
-            numpy.ndarray: Frame como imagen, o None si no hay frame disponible
+            tuple: (frame_id, bytes JPEG), o (last_id, None) si no hay frame nuevo
+        """
+        frame_id, jpeg, _, _ = self._latest
+        if frame_id == last_id:
+            # Solo se toma el lock si hay que esperar un frame nuevo
+            with self.frame_cond:
+                self.frame_cond.wait_for(lambda: self._latest[0] != last_id, timeout=timeout)
+            frame_id, jpeg, _, _ = self._latest
+            if frame_id == last_id:
+                return last_id, None
+        return frame_id, jpeg
+    
+    def subscribe(self, timeout=1.0):
+        """
+        Iterar sobre los frames JPEG nuevos a medida que se publican.
+        
+        Cada cliente es un generador bloqueado en la condición, sin consumir CPU
+        entre frames. Termina cuando se detiene la captura.
+        
+        Args:
+            timeout (float): Intervalo máximo entre comprobaciones de parada
+            
+        Yields:
+            bytes: Frame como JPEG
         """
-        with self.frame_lock:
-            if self.last_frame is not None and (time.time() - self.last_frame_time) < 10:
-                return self.last_frame.copy()
-        return None
+        last_id = 0
+        while self.running:
+            last_id, jpeg = self.wait_for_jpeg(last_id, timeout=timeout)
+            if jpeg is not None:
+                yield jpeg
+
+
+def _mjpeg_stream(camera):
+    """
+    Generar el stream MJPEG de una cámara al ritmo real de captura.
+    
+    Args:
+        camera (CameraStream): Cámara a transmitir
+        
+    Yields:
+        bytes: Partes del stream multipart (cabecera, JPEG, fin)
+    """
+    header = MJPEG_HEADER
+    end = MJPEG_END
+    for frame_bytes in camera.subscribe():
+        # Enviar por partes para no copiar el JPEG en un nuevo bytes
+        yield header
+        yield frame_bytes
+        yield end
 
 
 class RTSPWebServer:
@@ -138,6 +432,7 @@ class RTSPWebServer:
             config_path (str): Ruta al archivo de configuración
         """
         self.app = Flask(__name__)
+        self.sock = Sock(self.app) if Sock is not None else None
         self.config = self._load_config(config_path)
         self.cameras = {}
         self._setup_routes()
@@ -146,8 +441,7 @@ class RTSPWebServer:
     def _load_config(self, config_path):
         """Cargar configuración desde archivo JSON."""
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return load_config(config_path)
         except FileNotFoundError:
             print(f"❌ Error: No se encontró el archivo de configuración: {config_path}")
             return None
@@ -160,9 +454,10 @@ class RTSPWebServer:
         if not self.config:
             return
             
-        for camera_config in self.config['cameras']:
+        cpu_affinity = self.config.get('cpu_affinity', False)
+        for index, camera_config in enumerate(self.config['cameras']):
             camera_id = camera_config['id']
-            self.cameras[camera_id] = CameraStream(camera_config)
+            self.cameras[camera_id] = CameraStream(camera_config, index if cpu_affinity else None)
             self.cameras[camera_id].start()
             print(f"📹 Cámara {camera_id} inicializada")
     
@@ -188,25 +483,25 @@ class RTSPWebServer:
             if camera_id not in self.cameras:
                 return "Cámara no encontrada", 404
             
-            def generate_frames():
-                """Generar frames MJPEG."""
-                while True:
-                    frame = self.cameras[camera_id].get_frame()
-                    
-                    if frame is not None:
-                        # Codificar frame como JPEG
-                        ret, buffer = cv2.imencode('.jpg', frame, 
-                                                 [cv2.IMWRITE_JPEG_QUALITY, 85])
-                        if ret:
-                            frame_bytes = buffer.tobytes()
-                            yield (b'--frame\r\n'
-                                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                    
-                    time.sleep(0.033)  # ~30 FPS
-            
-            return Response(generate_frames(),
+            return Response(_mjpeg_stream(self.cameras[camera_id]),
                           mimetype='multipart/x-mixed-replace; boundary=frame')
         
+        if self.sock is not None:
+            @self.sock.route('/ws_feed/<camera_id>')
+            def ws_feed(ws, camera_id):
+                """
+                Stream de video por WebSocket: un mensaje binario JPEG por frame.
+                
+                Args:
+                    ws: Conexión WebSocket
+                    camera_id (str): ID de la cámara
+                """
+                if camera_id not in self.cameras:
+                    return
+                
+                for frame_bytes in self.cameras[camera_id].subscribe():
+                    ws.send(frame_bytes)
+        
         @self.app.route('/video_feed')
         def video_feed_default():
             """Stream de video para la primera cámara disponible."""
@@ -256,7 +551,6 @@ class RTSPWebServer:
                 for camera in self.cameras.values():
                     camera.stop()
                 # Salir del proceso
-                import os
                 os._exit(0)
             except Exception as e:
                 print(f"❌ Error deteniendo sistema: {e}")
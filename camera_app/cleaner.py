@@ -26,30 +26,41 @@ Fecha: 2024
 import json
 import os
 import sys
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from config_loader import load_config
+
 
 class RecordingCleaner:
     """Clase para manejar la limpieza automática de grabaciones."""
     
-    def __init__(self, config_path="config.json"):
+    _VIDEO_EXTS = frozenset(('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv'))
+    
+    def __init__(self, config_path="config.json", base_dir=None):
         """
         Inicializar el limpiador con configuración.
         
         Args:
             config_path (str): Ruta al archivo de configuración
+            base_dir (Path): Directorio contra el que resolver un
+                recordings_path relativo (None = directorio actual)
         """
         self.config = self._load_config(config_path)
         self.recordings_path = Path(self.config['recordings_path'])
+        if base_dir is not None and not self.recordings_path.is_absolute():
+            self.recordings_path = Path(base_dir) / self.recordings_path
         self.retention_days = self.config['retention_days']
-        self.cutoff_date = datetime.now() - timedelta(days=self.retention_days)
+        # Timestamps como float para comparar sin crear datetime por archivo
+        self._now_ts = time.time()
+        self.cutoff_date = datetime.fromtimestamp(self._now_ts) - timedelta(days=self.retention_days)
+        self._cutoff_ts = self.cutoff_date.timestamp()
     
     def _load_config(self, config_path):
         """Cargar configuración desde archivo JSON."""
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return load_config(config_path)
         except FileNotFoundError:
             print(f"❌ Error: No se encontró el archivo de configuración: {config_path}")
             sys.exit(1)
@@ -57,58 +68,49 @@ class RecordingCleaner:
             print(f"❌ Error al leer configuración JSON: {e}")
             sys.exit(1)
     
-    def _is_old_file(self, file_path):
+    def _is_old_file(self, stat):
         """
         Verificar si un archivo es más antiguo que el período de retención.
         
         Args:
-            file_path (Path): Ruta al archivo
+            stat (os.stat_result): Información del archivo
             
         Returns:
             bool: True si el archivo debe ser eliminado
         """
-        try:
-            # Usar fecha de modificación del sistema (más confiable)
-            file_mtime = datetime.fromtimestamp(file_path.stat().st_mtime)
-            return file_mtime < self.cutoff_date
-        except (OSError, ValueError) as e:
-            print(f"⚠️  Error verificando fecha de {file_path}: {e}")
-            return False
+        # Usar fecha de modificación del sistema (más confiable)
+        return stat.st_mtime < self._cutoff_ts
     
-    def _is_video_file(self, file_path):
+    def _is_video_file(self, file_name):
         """
         Verificar si un archivo es un video válido.
         
         Args:
-            file_path (Path): Ruta al archivo
+            file_name (str): Nombre del archivo
             
         Returns:
             bool: True si es un archivo de video
         """
-        video_extensions = {'.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv'}
-        return file_path.suffix.lower() in video_extensions
+        dot = file_name.rfind('.')
+        return dot > 0 and file_name[dot:].lower() in self._VIDEO_EXTS
     
-    def _get_file_info(self, file_path):
+    def _get_file_info(self, file_name, stat):
         """
         Obtener información detallada de un archivo.
         
         Args:
-            file_path (Path): Ruta al archivo
+            file_name (str): Nombre del archivo
+            stat (os.stat_result): Información del archivo
             
         Returns:
-            dict: Información del archivo
+            dict: Información del archivo ('mtime' como timestamp float)
         """
-        try:
-            stat = file_path.stat()
-            return {
-                'name': file_path.name,
-                'size_mb': round(stat.st_size / (1024 * 1024), 2),
-                'modified': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
-                'age_days': (datetime.now() - datetime.fromtimestamp(stat.st_mtime)).days
-            }
-        except (OSError, ValueError) as e:
-            print(f"⚠️  Error obteniendo info de {file_path}: {e}")
-            return None
+        return {
+            'name': file_name,
+            'size_mb': round(stat.st_size / (1024 * 1024), 2),
+            'mtime': stat.st_mtime,
+            'age_days': int((self._now_ts - stat.st_mtime) // 86400)
+        }
     
     def scan_recordings(self):
         """
@@ -131,22 +133,31 @@ class RecordingCleaner:
         print("-" * 60)
         
         try:
-            for file_path in self.recordings_path.iterdir():
-                if file_path.is_file():
-                    file_info = self._get_file_info(file_path)
-                    if not file_info:
+            # os.scandir evita crear objetos Path y reutiliza datos del directorio
+            with os.scandir(self.recordings_path) as entries:
+                for entry in entries:
+                    # Solo procesar archivos de video (sin stat para el resto)
+                    if not self._is_video_file(entry.name):
+                        if entry.is_file():
+                            print(f"⏭️  Saltando archivo no-video: {entry.name}")
+                        continue
+                    
+                    try:
+                        if not entry.is_file():
+                            continue
+                        stat = entry.stat()
+                    except OSError as e:
+                        print(f"⚠️  Error obteniendo info de {entry.name}: {e}")
                         continue
                     
+                    file_info = self._get_file_info(entry.name, stat)
+                    
                     total_size += file_info['size_mb']
                     
-                    # Solo procesar archivos de video
-                    if self._is_video_file(file_path):
-                        if self._is_old_file(file_path):
-                            files_to_delete.append((file_path, file_info))
-                        else:
-                            files_to_keep.append((file_path, file_info))
+                    if self._is_old_file(stat):
+                        files_to_delete.append((entry.name, file_info))
                     else:
-                        print(f"⏭️  Saltando archivo no-video: {file_path.name}")
+                        files_to_keep.append((entry.name, file_info))
         
         except PermissionError:
             print(f"❌ Error: Sin permisos para acceder a {self.recordings_path}")
@@ -169,7 +180,7 @@ class RecordingCleaner:
         Eliminar archivos antiguos.
         
         Args:
-            files_to_delete (list): Lista de archivos a eliminar
+            files_to_delete (list): Lista de (nombre, info) de archivos a eliminar
             
         Returns:
             dict: Estadísticas de eliminación
@@ -185,23 +196,45 @@ class RecordingCleaner:
         print(f"🗑️  Eliminando {len(files_to_delete)} archivos antiguos...")
         print("-" * 60)
         
-        for file_path, file_info in files_to_delete:
+        # Acumular la salida y escribirla de una vez al final
+        log_lines = []
+        
+        # Con dir_fd se elimina por nombre relativo al directorio ya abierto,
+        # sin resolver la ruta completa en cada archivo (no disponible en Windows)
+        dir_fd = None
+        if os.unlink in os.supports_dir_fd:
             try:
-                print(f"🗑️  Eliminando: {file_info['name']} "
-                      f"({file_info['size_mb']} MB, {file_info['age_days']} días)")
-                
-                file_path.unlink()  # Eliminar archivo
-                deleted_count += 1
-                deleted_size += file_info['size_mb']
-                
-            except PermissionError:
-                print(f"❌ Error: Sin permisos para eliminar {file_info['name']}")
-                errors += 1
-            except FileNotFoundError:
-                print(f"⚠️  Archivo ya eliminado: {file_info['name']}")
-            except Exception as e:
-                print(f"❌ Error eliminando {file_info['name']}: {e}")
-                errors += 1
+                dir_fd = os.open(self.recordings_path, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+            except OSError:
+                dir_fd = None
+        
+        try:
+            for file_name, file_info in files_to_delete:
+                try:
+                    log_lines.append(f"🗑️  Eliminando: {file_info['name']} "
+                                     f"({file_info['size_mb']} MB, {file_info['age_days']} días)")
+                    
+                    # Eliminar archivo
+                    if dir_fd is not None:
+                        os.unlink(file_name, dir_fd=dir_fd)
+                    else:
+                        os.unlink(os.path.join(self.recordings_path, file_name))
+                    deleted_count += 1
+                    deleted_size += file_info['size_mb']
+                    
+                except PermissionError:
+                    log_lines.append(f"❌ Error: Sin permisos para eliminar {file_info['name']}")
+                    errors += 1
+                except FileNotFoundError:
+                    log_lines.append(f"⚠️  Archivo ya eliminado: {file_info['name']}")
+                except Exception as e:
+                    log_lines.append(f"❌ Error eliminando {file_info['name']}: {e}")
+                    errors += 1
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+            if log_lines:
+                sys.stdout.write("\n".join(log_lines) + "\n")
         
         print("-" * 60)
         print(f"✅ Eliminación completada:")
@@ -263,8 +296,10 @@ class RecordingCleaner:
         
         # Mostrar archivos que se eliminarían
         print(f"\n📋 Archivos a eliminar ({len(files_to_delete)}):")
-        for file_path, file_info in files_to_delete:
-            print(f"   🗑️  {file_info['name']} - {file_info['size_mb']} MB - {file_info['age_days']} días")
+        sys.stdout.write("".join(
+            f"   🗑️  {file_info['name']} - {file_info['size_mb']} MB - {file_info['age_days']} días\n"
+            for _, file_info in files_to_delete
+        ))
         
         if not dry_run:
             # Eliminar archivos
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Carga de Configuración Compartida
+=================================
+
+Función común para leer config.json desde el grabador, el limpiador y
+el servidor web. El resultado se cachea por ruta y fecha de modificación,
+así las lecturas repetidas (ej: limpieza periódica en el mismo proceso)
+no vuelven a leer ni parsear el archivo si no cambió.
+
+Autor: Sistema de Vigilancia RTSP
+Fecha: 2024
+"""
+
+import json
+import os
+import threading
+
+_cache = {}  # Ruta absoluta -> ((mtime_ns, tamaño), configuración)
+_cache_lock = threading.Lock()
+
+
+def load_config(config_path="config.json"):
+    """
+    Cargar configuración desde archivo JSON, reutilizando el parseo previo.
+    
+    El diccionario devuelto se comparte entre llamadas: no debe modificarse.
+    
+    Args:
+        config_path (str): Ruta al archivo de configuración
+        
+    Returns:
+        dict: Configuración
+        
+    Raises:
+        FileNotFoundError: Si no existe el archivo
+        json.JSONDecodeError: Si el JSON no es válido
+    """
+    path = os.path.abspath(config_path)
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    
+    with _cache_lock:
+        _cache[path] = (key, config)
+    return config
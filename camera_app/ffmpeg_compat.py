@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compatibilidad entre versiones de FFmpeg
+========================================
+
+Opciones de línea de comandos cuyo nombre cambió entre versiones de FFmpeg.
+Usado por recorder.py y scan_cameras.py.
+"""
+
+import functools
+import subprocess
+
+
+@functools.lru_cache(maxsize=None)
+def rtsp_timeout_option(program='ffprobe'):
+    """
+    Obtener la opción de timeout de socket RTSP del FFmpeg instalado.
+
+    En FFmpeg < 5 (ej: Ubuntu 22.04, Debian 11) '-timeout' del demuxer RTSP
+    es el tiempo de espera en modo escucha y activa ese modo; el timeout de
+    socket es '-stimeout'. Desde FFmpeg 5 '-stimeout' ya no existe y
+    '-timeout' es el de socket. Ambos en microsegundos.
+
+    Se consulta una sola vez por programa y proceso.
+
+    Args:
+        program (str): Ejecutable a consultar ('ffprobe' o 'ffmpeg')
+
+    Returns:
+        str: '-stimeout' o '-timeout'
+    """
+    try:
+        result = subprocess.run([program, '-hide_banner', '-h', 'demuxer=rtsp'],
+                                capture_output=True, text=True, timeout=10)
+    except (OSError, subprocess.TimeoutExpired):
+        return '-timeout'
+    return '-stimeout' if 'stimeout' in result.stdout else '-timeout'
@@ -26,6 +26,14 @@ import sys
 from datetime import datetime
 from pathlib import Path
 
+from config_loader import load_config
+from ffmpeg_compat import rtsp_timeout_option
+
+LOG_MAX_BYTES = 1024 * 1024  # Tamaño máximo de cada log de FFmpeg antes de rotar
+PROBE_SOCKET_TIMEOUT_US = '5000000'  # Timeout de socket de ffprobe (microsegundos)
+PROBE_TIMEOUT = 15                   # Segundos máximos por ffprobe
+PROBE_RETRY_INTERVAL = 300           # Segundos sin volver a detectar códecs tras un fallo
+
 
 class RTSPRecorder:
     """Clase para manejar la grabación de streams RTSP."""
@@ -39,6 +47,10 @@ class RTSPRecorder:
         """
         self.config = self._load_config(config_path)
         self.processes = {}  # Para almacenar procesos FFmpeg por cámara
+        self.codec_args = {}  # Argumentos de códec por cámara (detectados con ffprobe)
+        self._probe_retry_at = {}  # Cámara -> instante (monotónico) del próximo intento tras un fallo
+        # Grabar todas las cámaras con un único proceso FFmpeg (opcional)
+        self.combined_recording = self.config.get('combined_recording', False)
         self.running = True
         
         # Configurar manejo de señales para cierre graceful
@@ -48,8 +60,7 @@ class RTSPRecorder:
     def _load_config(self, config_path):
         """Cargar configuración desde archivo JSON."""
         try:
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            return load_config(config_path)
         except FileNotFoundError:
             print(f"❌ Error: No se encontró el archivo de configuración: {config_path}")
             sys.exit(1)
@@ -69,36 +80,167 @@ class RTSPRecorder:
         recordings_path = Path(self.config['recordings_path'])
         recordings_path.mkdir(parents=True, exist_ok=True)
         print(f"📁 Directorio de grabaciones: {recordings_path.absolute()}")
+        
+        logs_path = Path(self.config.get('logs_path', 'logs'))
+        logs_path.mkdir(parents=True, exist_ok=True)
     
-    def _build_ffmpeg_command(self, camera):
+    def _open_log(self, camera_id):
+        """
+        Abrir el log de errores de FFmpeg para una cámara.
+        
+        Si el log supera el tamaño máximo se rota a '<camera_id>.log.1'.
+        
+        Args:
+            camera_id (str): ID de la cámara
+            
+        Returns:
+            file: Archivo de log abierto en modo binario para agregar
+        """
+        log_path = Path(self.config.get('logs_path', 'logs')) / f"{camera_id}.log"
+        try:
+            if log_path.stat().st_size > LOG_MAX_BYTES:
+                log_path.replace(log_path.with_suffix('.log.1'))
+        except FileNotFoundError:
+            pass
+        return open(log_path, 'ab', buffering=0)
+    
+    def _probe_codecs(self, camera):
+        """
+        Detectar los códecs de video y audio del stream con ffprobe.
+        
+        Args:
+            camera (dict): Configuración de la cámara
+            
+        Returns:
+            dict: Códec por tipo de stream ('video', 'audio'), vacío si falló
         """
-        Construir comando FFmpeg para una cámara específica.
+        cmd = [
+            'ffprobe',
+            '-v', 'error',
+            '-rtsp_transport', 'tcp',
+            rtsp_timeout_option(), PROBE_SOCKET_TIMEOUT_US,  # Fallar rápido si la cámara no responde
+            '-show_entries', 'stream=codec_type,codec_name',
+            '-of', 'json',
+            camera['rtsp_url']
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=PROBE_TIMEOUT)
+            if result.returncode != 0:
+                return {}
+            codecs = {}
+            for stream in json.loads(result.stdout).get('streams', []):
+                codecs.setdefault(stream.get('codec_type'), stream.get('codec_name'))
+            return codecs
+        except (subprocess.TimeoutExpired, FileNotFoundError, json.JSONDecodeError) as e:
+            print(f"⚠️  No se pudieron detectar códecs de {camera['id']}: {e}")
+            return {}
+    
+    def _get_codec_args(self, camera):
+        """
+        Obtener argumentos de códec para una cámara, detectándolos una sola vez.
+        
+        Si el stream ya es H.264/AAC se copia tal cual (sin transcodificar);
+        solo se recodifica lo que no es compatible con MP4.
         
         Args:
             camera (dict): Configuración de la cámara
             
+        Returns:
+            list: Argumentos de códec para FFmpeg
+        """
+        camera_id = camera['id']
+        if camera_id in self.codec_args:
+            return self.codec_args[camera_id]
+        
+        fallback_args = ['-c:v', 'libx264', '-preset', 'fast', '-crf', '23', '-c:a', 'aac']
+        if time.monotonic() < self._probe_retry_at.get(camera_id, 0):
+            # Detección fallida hace poco (ej: cámara apagada): no bloquear otra vez
+            return fallback_args
+        
+        codecs = self._probe_codecs(camera)
+        if not codecs:
+            # Sin información: recodificar como antes y reintentar la detección
+            # pasado PROBE_RETRY_INTERVAL
+            self._probe_retry_at[camera_id] = time.monotonic() + PROBE_RETRY_INTERVAL
+            return fallback_args
+        self._probe_retry_at.pop(camera_id, None)
+        
+        video_codec = codecs.get('video')
+        audio_codec = codecs.get('audio')
+        
+        if video_codec == 'h264':
+            args = ['-c:v', 'copy']
+        else:
+            args = ['-c:v', 'libx264', '-preset', 'fast', '-crf', '23']
+        
+        if audio_codec is None:
+            args += ['-an']
+        elif audio_codec == 'aac':
+            args += ['-c:a', 'copy', '-bsf:a', 'aac_adtstoasc']
+        else:
+            args += ['-c:a', 'aac']
+        
+        print(f"🔍 Códecs de {camera_id}: video={video_codec}, audio={audio_codec}")
+        self.codec_args[camera_id] = args
+        return args
+    
+    def _recording_targets(self):
+        """
+        Obtener las grabaciones a mantener activas.
+        
+        Con 'combined_recording' todas las cámaras se agrupan en una sola
+        grabación (un único proceso FFmpeg con varias entradas), que comparte
+        hilos e inicialización pero se reinicia completa si una cámara falla.
+        
+        Returns:
+            list: Configuraciones de cámara o de grupo ('cameras' con la lista)
+        """
+        cameras = self.config['cameras']
+        if self.combined_recording and len(cameras) > 1:
+            return [{'id': 'all', 'name': 'Todas las cámaras', 'cameras': cameras}]
+        return cameras
+    
+    def _build_ffmpeg_command(self, camera):
+        """
+        Construir comando FFmpeg para una cámara o un grupo de cámaras.
+        
+        Args:
+            camera (dict): Configuración de la cámara o del grupo
+            
         Returns:
             list: Comando FFmpeg como lista de argumentos
         """
-        # Obtener timestamp actual para el nombre del archivo
+        # Obtener timestamp actual para el nombre de los archivos
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        output_file = f"{self.config['recordings_path']}/{camera['id']}_{timestamp}.mp4"
+        duration = str(self.config.get('segment_duration', 3600))  # Duración de grabación (segundos)
+        cameras = camera.get('cameras', [camera])
         
-        # Comando FFmpeg optimizado para streams RTSP con codificación H.264
+        # Comando FFmpeg optimizado para streams RTSP (copia directa si es H.264/AAC)
         cmd = [
             'ffmpeg',
-            '-rtsp_transport', 'tcp',           # Usar TCP para mayor estabilidad
-            '-i', camera['rtsp_url'],           # URL de entrada RTSP
-            '-c:v', 'libx264',                  # Codificar video en H.264 (compatible con Windows)
-            '-preset', 'fast',                  # Preset rápido para mejor rendimiento
-            '-crf', '23',                       # Calidad de video (18-28, menor = mejor calidad)
-            '-c:a', 'aac',                      # Convertir audio a AAC (compatible con MP4)
-            '-t', str(self.config.get('segment_duration', 3600)),  # Duración de grabación (segundos)
             '-loglevel', 'error',               # Solo mostrar errores
             '-y',                               # Sobrescribir archivos existentes
-            output_file
         ]
         
+        for cam in cameras:
+            cmd += [
+                '-rtsp_transport', 'tcp',       # Usar TCP para mayor estabilidad
+                '-fflags', '+genpts',           # Regenerar PTS faltantes del stream RTSP
+                '-i', cam['rtsp_url'],          # URL de entrada RTSP
+            ]
+        
+        # Una salida por entrada: video y audio (si existe) de cada cámara
+        for index, cam in enumerate(cameras):
+            output_file = f"{self.config['recordings_path']}/{cam['id']}_{timestamp}.mp4"
+            cmd += [
+                '-map', f'{index}:v',
+                '-map', f'{index}:a?',
+                *self._get_codec_args(cam),     # Copiar o recodificar según códecs detectados
+                '-avoid_negative_ts', 'make_zero',  # Normalizar timestamps sin recodificar
+                '-t', duration,
+                output_file
+            ]
+        
         return cmd
     
     def start_recording(self, camera):
@@ -117,25 +259,20 @@ class RTSPRecorder:
         try:
             cmd = self._build_ffmpeg_command(camera)
             print(f"🎥 Iniciando grabación para {camera['name']} ({camera_id})")
-            print(f"📡 URL: {camera['rtsp_url']}")
-            
-            # Iniciar proceso FFmpeg
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
-            )
+            for cam in camera.get('cameras', [camera]):
+                print(f"📡 URL: {cam['rtsp_url']}")
             
-            # Verificar si el proceso se inició correctamente
-            time.sleep(2)  # Esperar un momento para que FFmpeg se inicie
-            if process.poll() is not None:
-                # El proceso terminó inmediatamente, leer errores
-                stdout, stderr = process.communicate()
-                print(f"❌ FFmpeg falló inmediatamente:")
-                print(f"STDOUT: {stdout.decode('utf-8', errors='ignore')}")
-                print(f"STDERR: {stderr.decode('utf-8', errors='ignore')}")
-                return
+            # Iniciar proceso FFmpeg. Los errores van a un log por cámara: con
+            # PIPE sin leer, FFmpeg se bloquearía al llenarse el buffer.
+            # Si falla, check_and_restart_recordings lo detecta y lo reinicia.
+            with self._open_log(camera_id) as log_file:
+                process = subprocess.Popen(
+                    cmd,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=log_file,
+                    creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
+                )
             
             self.processes[camera_id] = process
             print(f"✅ Grabación iniciada - PID: {process.pid}")
@@ -170,8 +307,13 @@ class RTSPRecorder:
             self.stop_recording(camera_id)
     
     def check_and_restart_recordings(self):
-        """Verificar y reiniciar grabaciones que hayan fallado o completado."""
-        for camera in self.config['cameras']:
+        """
+        Verificar y reiniciar grabaciones que hayan fallado o completado.
+        
+        Returns:
+            int: Número de grabaciones activas tras la verificación
+        """
+        for camera in self._recording_targets():
             camera_id = camera['id']
             
             # Si no hay proceso o el proceso terminó (completado o falló)
@@ -183,11 +325,15 @@ class RTSPRecorder:
                         print(f"✅ Archivo completado para {camera['name']} ({camera_id})")
                     else:
                         print(f"⚠️  Grabación falló para {camera['name']} ({camera_id})")
+                        print(f"💡 Ver errores de FFmpeg en {self.config.get('logs_path', 'logs')}/{camera_id}.log")
                     del self.processes[camera_id]
                 
                 # Iniciar nueva grabación
                 print(f"🔄 Iniciando nueva grabación para {camera['name']} ({camera_id})")
                 self.start_recording(camera)
+        
+        # Los procesos terminados ya se eliminaron del diccionario
+        return len(self.processes)
     
     def run(self):
         """Ejecutar el grabador principal con reconexión automática."""
@@ -198,7 +344,7 @@ class RTSPRecorder:
         self._create_recordings_directory()
         
         # Iniciar grabaciones para todas las cámaras
-        for camera in self.config['cameras']:
+        for camera in self._recording_targets():
             self.start_recording(camera)
         
         print(f"\n📊 Estado: {len(self.processes)} grabaciones activas")
@@ -206,16 +352,18 @@ class RTSPRecorder:
         print("=" * 50)
         
         # Bucle principal con verificación periódica
+        next_status = time.monotonic() + 300
         try:
             while self.running:
                 time.sleep(self.config.get('ffmpeg_reconnect_delay', 10))
                 
                 # Verificar y reiniciar grabaciones si es necesario
-                self.check_and_restart_recordings()
+                active_count = self.check_and_restart_recordings()
                 
                 # Mostrar estado cada 5 minutos
-                if int(time.time()) % 300 == 0:
-                    active_count = sum(1 for p in self.processes.values() if p.poll() is None)
+                now = time.monotonic()
+                if now >= next_status:
+                    next_status = now + 300
                     print(f"📊 Estado: {active_count} grabaciones activas - {datetime.now().strftime('%H:%M:%S')}")
         
         except KeyboardInterrupt:
@@ -7,120 +7,724 @@ Escáner de Cámaras RTSP en la Red
 Script para encontrar cámaras RTSP en la red local.
 """
 
+import asyncio
+import functools
+import os
+import signal
+import struct
 import subprocess
 import socket
-import threading
+import sys
 import time
 from concurrent.futures import ThreadPoolExecutor
 
-def ping_host(ip):
-    """Hacer ping a una IP para verificar si está activa."""
+from ffmpeg_compat import rtsp_timeout_option
+
+try:
+    # PyAV: abrir RTSP dentro del proceso, sin el arranque de ffprobe por URL
+    import av
+except ImportError:
+    av = None
+
+PING_TIMEOUT = 1.0        # Segundos de espera por respuesta de ping
+ARP_TIMEOUT = 1.0         # Segundos de espera por respuestas ARP
+MAX_PING_PROCESSES = 50   # Procesos ping simultáneos si no hay socket ICMP
+
+TCP_TIMEOUT = 1.0         # Segundos de espera para conectar al puerto RTSP
+RTSP_DESCRIBE_TIMEOUT = 2.0  # Segundos de espera por la respuesta al DESCRIBE
+RTSP_REPLY_BYTES = 1024   # Bytes leídos de la respuesta: alcanza para Server y el realm
+RTSP_PROBE_TIMEOUT = 10   # Segundos máximos por ffprobe
+RTSP_SOCKET_TIMEOUT_US = '3000000'  # Timeout de socket de ffprobe (microsegundos)
+
+SWEEP_CACHE_TTL = 60      # Segundos que se reutilizan los hosts activos de un barrido
+DEFAULT_LOCAL_IP = "192.168.0.204"  # Si no se puede detectar la IP local
+
+# Credenciales por defecto a probar con las rutas de un fabricante conocido
+DEFAULT_CREDENTIALS = ['admin:admin', 'admin:123456', 'admin:password', 'admin:']
+
+# Rutas RTSP por fabricante, detectado en la respuesta al DESCRIBE.
+# Los patrones se buscan (en minúsculas) en la cabecera Server y el realm del 401.
+VENDOR_URLS = {
+    'dahua': {
+        'patterns': ['dahua', 'login to '],
+        'paths': ['/cam/realmonitor?channel=1&subtype=0'],
+    },
+    'hikvision': {
+        'patterns': ['hikvision', 'ip camera('],
+        'paths': ['/h264/ch1/main/av_stream'],
+    },
+}
+
+# Workers concurrentes por etapa del escaneo (puerto 554 -> RTSP).
+# TCP_WORKERS también limita los sockets abiertos a la vez. Los workers RTSP
+# son baratos: el límite real es MAX_RTSP_PROBES, compartido por todas las
+# cámaras para que una lenta no retrase a las demás.
+TCP_WORKERS = 254
+RTSP_WORKERS = 254
+MAX_RTSP_PROBES = 32      # Pruebas de URL (ffprobe/PyAV) simultáneas en todo el escaneo
+
+
+# Hosts activos del último barrido por red: {network_base: (instante, [ips])}
+_sweep_cache = {}
+
+
+def _write_lines(lines):
+    """Escribir varias líneas en stdout con una sola llamada."""
+    text = "".join(f"{line}\n" for line in lines)
+    if text:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+
+@functools.lru_cache(maxsize=1)
+def get_network_base():
+    """
+    Obtener los tres primeros octetos de la red local.
+    
+    La IP local se detecta una sola vez por proceso.
+    
+    Returns:
+        str: Base de la red (ej: '192.168.0')
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # No envía nada: solo elige la interfaz de salida
+        s.connect(("8.8.8.8", 80))
+        local_ip = s.getsockname()[0]
+    except OSError:
+        local_ip = DEFAULT_LOCAL_IP
+    finally:
+        s.close()
+    return ".".join(local_ip.split(".")[:-1])
+
+
+def _arp_sweep(network_base):
+    """
+    Descubrir los hosts de la red local con un barrido ARP (bloqueante).
+    
+    Args:
+        network_base (str): Primeros tres octetos de la red
+        
+    Returns:
+        list: IPs que respondieron, o None si no hay scapy, faltan permisos
+        o nadie respondió (ej: la red no es la del equipo)
+    """
+    try:
+        # Importación diferida: scapy.all tarda cientos de ms en cargarse y
+        # solo se necesita aquí, ya en un hilo fuera del bucle de eventos
+        from scapy.all import arping
+    except ImportError:
+        return None
+    try:
+        answered, _ = arping(f"{network_base}.0/24", timeout=ARP_TIMEOUT, verbose=0)
+    except Exception:
+        # Sin root o sin interfaz en esa red: scapy lanza distintos errores
+        return None
+    return [received.psrc for _, received in answered] or None
+
+
+def _cached_active_hosts(network_base):
+    """
+    Obtener los hosts activos de un barrido reciente de la misma red.
+    
+    Args:
+        network_base (str): Primeros tres octetos de la red
+        
+    Returns:
+        list: IPs activas, o None si no hay barrido de menos de SWEEP_CACHE_TTL
+    """
+    cached = _sweep_cache.get(network_base)
+    if cached is None or time.monotonic() - cached[0] >= SWEEP_CACHE_TTL:
+        return None
+    return cached[1]
+
+
+def _icmp_checksum(data):
+    """Calcular checksum ICMP (complemento a uno de la suma de 16 bits)."""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+
+def _build_echo_request(ident, seq):
+    """Construir un paquete ICMP echo request."""
+    payload = b'rtsp-scan'
+    header = struct.pack('!BBHHH', 8, 0, 0, ident, seq)
+    checksum = _icmp_checksum(header + payload)
+    return struct.pack('!BBHHH', 8, 0, checksum, ident, seq) + payload
+
+
+class IcmpPinger:
+    """Barrido ICMP con un único socket compartido por todas las IPs."""
+    
+    def __init__(self, sock, raw=False):
+        """
+        Inicializar pinger sobre un socket ICMP ya abierto.
+        
+        Args:
+            sock (socket.socket): Socket ICMP no bloqueante
+            raw (bool): True si es un socket SOCK_RAW (recibe todo el ICMP del host)
+        """
+        self.sock = sock
+        self.raw = raw
+        self.ident = os.getpid() & 0xFFFF
+        self.loop = asyncio.get_running_loop()
+        self.replies = asyncio.Queue()  # IPs de origen de los echo reply recibidos
+        self.loop.add_reader(sock.fileno(), self._on_readable)
+    
+    @classmethod
+    def create(cls):
+        """
+        Abrir el socket ICMP: sin privilegios (Linux/macOS) o raw (root).
+        
+        Returns:
+            IcmpPinger: Pinger listo, o None si el sistema no lo permite
+        """
+        for sock_type in (socket.SOCK_DGRAM, socket.SOCK_RAW):
+            try:
+                sock = socket.socket(socket.AF_INET, sock_type, socket.IPPROTO_ICMP)
+                break
+            except OSError:
+                continue
+        else:
+            return None
+        sock.setblocking(False)
+        try:
+            return cls(sock, raw=(sock_type == socket.SOCK_RAW))
+        except NotImplementedError:
+            # Bucle de eventos sin add_reader (ej: Proactor en Windows)
+            sock.close()
+            return None
+    
+    def _on_readable(self):
+        """Leer todas las respuestas disponibles y encolar su IP de origen."""
+        while True:
+            try:
+                data, (src, _) = self.sock.recvfrom(1500)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            
+            # En algunos sistemas la respuesta incluye la cabecera IP
+            if len(data) >= 20 and data[0] >> 4 == 4:
+                data = data[(data[0] & 0x0F) * 4:]
+            if len(data) < 8 or data[0] != 0:  # 0 = echo reply
+                continue
+            # El socket raw también recibe las respuestas a pings de otros
+            # procesos; con SOCK_DGRAM el kernel ya filtra por socket
+            if self.raw and struct.unpack_from('!H', data, 4)[0] != self.ident:
+                continue
+            
+            self.replies.put_nowait(src)
+    
+    async def sweep(self, ips, timeout=PING_TIMEOUT):
+        """
+        Enviar un echo request a todas las IPs y luego recoger respuestas.
+        
+        Todas las esperas comparten un único plazo: el barrido completo tarda
+        como máximo 'timeout', en lugar de un RTT por host.
+        
+        Args:
+            ips (list): IPs destino
+            timeout (float): Plazo total desde el último envío
+            
+        Yields:
+            str: IP de cada host que respondió, en orden de llegada
+        """
+        pending = set()
+        for seq, ip in enumerate(ips, 1):
+            packet = _build_echo_request(self.ident, seq)
+            for _ in range(100):
+                try:
+                    self.sock.sendto(packet, (ip, 0))
+                    pending.add(ip)
+                    break
+                except BlockingIOError:
+                    # Buffer de envío lleno: dejar que se vacíe
+                    await asyncio.sleep(0.001)
+                except OSError:
+                    break  # Ej: red inalcanzable para esa IP
+        
+        deadline = self.loop.time() + timeout
+        while pending:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return
+            try:
+                src = await asyncio.wait_for(self.replies.get(), remaining)
+            except asyncio.TimeoutError:
+                return
+            if src in pending:
+                pending.discard(src)
+                yield src
+    
+    def close(self):
+        """Cerrar el socket."""
+        self.loop.remove_reader(self.sock.fileno())
+        self.sock.close()
+
+
+def _spawn_kwargs():
+    """Opciones comunes para lanzar ping/ffprobe sin salida en consola."""
+    # Sesión propia en POSIX: Ctrl+C llega solo al escáner, que mata a sus hijos
+    return {'stdout': subprocess.DEVNULL, 'stderr': subprocess.DEVNULL,
+            'start_new_session': os.name != 'nt'}
+
+
+async def _kill_process(proc):
+    """
+    Matar un subproceso (y su grupo en POSIX) si sigue vivo y esperar su fin.
+    
+    Args:
+        proc (asyncio.subprocess.Process): Proceso a terminar
+    """
+    if proc.returncode is None:
+        try:
+            if os.name == 'nt':
+                proc.kill()
+            else:
+                os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass  # Terminó justo antes de matarlo
+    await proc.wait()
+
+
+async def ping_host_async(ip):
+    """
+    Hacer ping a una IP con el comando del sistema, sin bloquear el bucle.
+    
+    Se usa cuando no hay socket ICMP disponible para IcmpPinger.
+    
+    Args:
+        ip (str): IP a verificar
+        
+    Returns:
+        bool: True si el host respondió
+    """
+    if os.name == 'nt':
+        cmd = ['ping', '-n', '1', '-w', str(int(PING_TIMEOUT * 1000)), ip]
+    else:
+        cmd = ['ping', '-c', '1', '-W', str(int(PING_TIMEOUT)), ip]
+    
+    try:
+        proc = await asyncio.create_subprocess_exec(*cmd, **_spawn_kwargs())
+    except OSError:
+        return False
     try:
-        result = subprocess.run(['ping', '-n', '1', '-w', '1000', ip], 
-                              capture_output=True, text=True, timeout=5)
-        return result.returncode == 0
-    except:
+        return await asyncio.wait_for(proc.wait(), 5) == 0
+    except asyncio.TimeoutError:
         return False
+    finally:
+        # Por timeout o al cancelar el escaneo, no dejar el ping vivo
+        await _kill_process(proc)
+
 
-def test_rtsp_port(ip, port=554):
-    """Probar si el puerto RTSP está abierto."""
+async def probe_rtsp_describe_async(ip, port=554, timeout=TCP_TIMEOUT):
+    """
+    Conectar al puerto RTSP y enviar un DESCRIBE sin credenciales.
+    
+    Las conexiones se multiplexan en el bucle de eventos, así cientos de
+    hosts se prueban a la vez en lugar de uno por uno. Se usa DESCRIBE y no
+    OPTIONS porque la mayoría de las cámaras responden 200 a OPTIONS sin
+    autenticar y solo piden credenciales al pedir el stream.
+    
+    Usa el socket directamente (sin StreamReader/StreamWriter): un solo
+    envío y una sola lectura no necesitan transporte ni buffers propios.
+    
+    Args:
+        ip (str): IP a probar
+        port (int): Puerto RTSP
+        timeout (float): Tiempo máximo de conexión
+        
+    Returns:
+        bytes: Inicio de la respuesta (b'' si no respondió), o None si el
+        puerto no aceptó la conexión
+    """
+    loop = asyncio.get_running_loop()
+    # Solo IPv4: las IPs del barrido son siempre de la /24 local
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setblocking(False)
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.settimeout(2)
-        result = sock.connect_ex((ip, port))
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+        except (asyncio.TimeoutError, OSError):
+            return None
+        try:
+            await loop.sock_sendall(sock, f"DESCRIBE rtsp://{ip}:{port}/ RTSP/1.0\r\n"
+                                          f"CSeq: 1\r\n"
+                                          f"Accept: application/sdp\r\n"
+                                          f"User-Agent: scan\r\n\r\n".encode())
+            return await asyncio.wait_for(loop.sock_recv(sock, RTSP_REPLY_BYTES),
+                                        RTSP_DESCRIBE_TIMEOUT)
+        except (asyncio.TimeoutError, OSError):
+            return b''
+    finally:
         sock.close()
-        return result == 0
-    except:
+
+
+def _rtsp_status(reply):
+    """
+    Obtener el código de estado de una respuesta RTSP.
+    
+    Args:
+        reply (bytes): Inicio de la respuesta del servidor
+        
+    Returns:
+        int: Código de estado (ej: 200, 401), o None si no es RTSP
+    """
+    parts = reply.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'RTSP/') or not parts[1].isdigit():
+        return None
+    return int(parts[1])
+
+
+def _detect_vendor(reply):
+    """
+    Identificar el fabricante por la respuesta al DESCRIBE.
+    
+    Args:
+        reply (bytes): Inicio de la respuesta del servidor
+        
+    Returns:
+        str: Clave de VENDOR_URLS, o None si no se reconoce
+    """
+    server = realm = ''
+    for line in reply.decode('latin-1').split('\r\n')[1:]:
+        name, _, value = line.partition(':')
+        name = name.strip().lower()
+        if name == 'server':
+            server = value.lower()
+        elif name == 'www-authenticate':
+            realm = value.lower().partition('realm=')[2]
+    
+    # La cabecera Server es más fiable que el realm: se revisa primero
+    for field in (server, realm):
+        if not field:
+            continue
+        for vendor, info in VENDOR_URLS.items():
+            if any(pattern in field for pattern in info['patterns']):
+                return vendor
+    return None
+
+
+def _candidate_urls(ip, port=554, vendor=None):
+    """
+    Obtener URLs RTSP a probar con credenciales y rutas comunes.
+    
+    Args:
+        ip (str): IP de la cámara
+        port (int): Puerto RTSP
+        vendor (str): Fabricante detectado (clave de VENDOR_URLS), o None
+        
+    Returns:
+        list: URLs candidatas; solo las del fabricante si se conoce
+    """
+    if vendor in VENDOR_URLS:
+        return [f"rtsp://{credentials}@{ip}:{port}{path}"
+                for path in VENDOR_URLS[vendor]['paths']
+                for credentials in DEFAULT_CREDENTIALS]
+    
+    return [
+        f"rtsp://admin:admin@{ip}:{port}/stream1",
+        f"rtsp://admin:123456@{ip}:{port}/stream1", 
+        f"rtsp://admin:password@{ip}:{port}/stream1",
+        f"rtsp://admin:@{ip}:{port}/stream1",
+        f"rtsp://{ip}:{port}/stream1",
+        f"rtsp://admin:admin@{ip}:{port}/cam/realmonitor?channel=1&subtype=0",
+        f"rtsp://admin:admin@{ip}:{port}/h264/ch1/main/av_stream",
+    ]
+
+
+def _open_with_av(url):
+    """
+    Abrir una URL RTSP con PyAV (bloqueante, se ejecuta en un hilo).
+    
+    Args:
+        url (str): URL RTSP
+        
+    Returns:
+        bool: True si se pudo abrir el stream
+    """
+    # PyAV trae su propio libavformat: en FFmpeg < 5 (libavformat < 59) el
+    # timeout de socket RTSP se llama 'stimeout'
+    timeout_key = 'stimeout' if av.library_versions['libavformat'][0] < 59 else 'timeout'
+    try:
+        container = av.open(url, timeout=RTSP_PROBE_TIMEOUT,
+                            options={'rtsp_transport': 'tcp',
+                                     timeout_key: RTSP_SOCKET_TIMEOUT_US})
+    except Exception:
         return False
+    container.close()
+    return True
+
+
+async def _probe_url_av(url, semaphore=None, executor=None):
+    """
+    Probar una URL RTSP con PyAV en un hilo del pool de pruebas.
+    
+    av.open no se puede interrumpir: al cancelar la tarea el hilo sigue
+    hasta su timeout. Por eso el cupo del semáforo se libera cuando el hilo
+    termina de verdad, no cuando se cancela la tarea.
+    
+    Args:
+        url (str): URL RTSP
+        semaphore (asyncio.Semaphore): Límite global de pruebas, o None
+        executor (ThreadPoolExecutor): Pool de pruebas (None = pool por defecto)
+        
+    Returns:
+        str: La URL si se pudo abrir el stream, o None
+    """
+    loop = asyncio.get_running_loop()
+    if semaphore is not None:
+        await semaphore.acquire()
+    try:
+        future = loop.run_in_executor(executor, _open_with_av, url)
+    except BaseException:
+        if semaphore is not None:
+            semaphore.release()
+        raise
+    if semaphore is not None:
+        future.add_done_callback(lambda _: semaphore.release())
+    # shield: cancelar la tarea no debe dar el futuro por terminado
+    return url if await asyncio.shield(future) else None
+
 
-def test_rtsp_connection(ip, port=554):
-    """Probar conexión RTSP básica."""
+async def _probe_url(url, semaphore=None, executor=None):
+    """
+    Probar una URL RTSP con PyAV si está instalado, o con ffprobe.
+    
+    Args:
+        url (str): URL RTSP
+        semaphore (asyncio.Semaphore): Límite global de pruebas, o None
+        executor (ThreadPoolExecutor): Pool para las pruebas con PyAV, o None
+        
+    Returns:
+        str: La URL si se pudo abrir el stream, o None
+    """
+    if av is not None:
+        return await _probe_url_av(url, semaphore, executor)
+    
+    if semaphore is not None:
+        async with semaphore:
+            return await _probe_url(url)
+    
     try:
-        # Probar con credenciales comunes
-        test_urls = [
-            f"rtsp://admin:admin@{ip}:{port}/stream1",
-            f"rtsp://admin:123456@{ip}:{port}/stream1", 
-            f"rtsp://admin:password@{ip}:{port}/stream1",
-            f"rtsp://admin:@{ip}:{port}/stream1",
-            f"rtsp://{ip}:{port}/stream1",
-            f"rtsp://admin:admin@{ip}:{port}/cam/realmonitor?channel=1&subtype=0",
-            f"rtsp://admin:admin@{ip}:{port}/h264/ch1/main/av_stream",
-        ]
-        
-        for url in test_urls:
-            try:
-                result = subprocess.run(['ffprobe', '-v', 'quiet', '-print_format', 'json', '-show_streams', url], 
-                                      capture_output=True, text=True, timeout=10)
-                if result.returncode == 0:
-                    return url
-            except:
-                continue
+        proc = await asyncio.create_subprocess_exec(
+            'ffprobe', '-v', 'quiet',
+            '-rtsp_transport', 'tcp',
+            rtsp_timeout_option(), RTSP_SOCKET_TIMEOUT_US,  # Fallar rápido si la cámara no responde
+            url,
+            **_spawn_kwargs())
+    except OSError:
         return None
-    except:
+    
+    try:
+        returncode = await asyncio.wait_for(proc.wait(), RTSP_PROBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        returncode = None
+    finally:
+        # Al cancelar (otra URL ya funcionó o Ctrl+C) o por timeout, terminar ffprobe
+        await _kill_process(proc)
+    return url if returncode == 0 else None
+
+
+async def test_rtsp_connection_async(ip, port=554, vendor=None, semaphore=None,
+                                     executor=None):
+    """
+    Probar conexión RTSP básica con todas las URLs candidatas a la vez.
+    
+    La primera URL que funciona cancela las pruebas pendientes de la misma
+    IP, incluidas las que aún esperan turno en el semáforo.
+    
+    Args:
+        ip (str): IP de la cámara
+        port (int): Puerto RTSP
+        vendor (str): Fabricante detectado, o None para probar todas las URLs
+        semaphore (asyncio.Semaphore): Límite global de pruebas, o None
+        executor (ThreadPoolExecutor): Pool para las pruebas con PyAV, o None
+        
+    Returns:
+        str: Primera URL que respondió, o None
+    """
+    tasks = [asyncio.create_task(_probe_url(url, semaphore, executor))
+             for url in _candidate_urls(ip, port, vendor)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            url = await next_done
+            if url:
+                return url
         return None
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def scan_pipeline(network_base):
+    """
+    Escanear la red /24 con las tres fases encadenadas.
+    
+    Cada host que responde al ping pasa inmediatamente a la prueba del
+    puerto 554, que envía un DESCRIBE RTSP; si el stream no está abierto
+    sin credenciales, la IP pasa a la prueba de URLs candidatas. Ninguna
+    etapa espera a que la anterior termine para toda la red.
+    
+    Args:
+        network_base (str): Primeros tres octetos de la red (ej: '192.168.0')
+        
+    Returns:
+        tuple: (hosts_activos, ips_con_puerto_rtsp, {ip: url_rtsp o None})
+    """
+    active_hosts = []
+    rtsp_cameras = []
+    working_urls = {}
+    
+    # Las 254 IPs se generan una sola vez; su posición sirve para ordenar
+    ips = [f"{network_base}.{i}" for i in range(1, 255)]
+    ip_order = {ip: i for i, ip in enumerate(ips)}
+    ping_q = asyncio.Queue()
+    tcp_q = asyncio.Queue()
+    rtsp_q = asyncio.Queue()
+    
+    # Hosts ya conocidos (barrido reciente o ARP) evitan el barrido ICMP
+    known_hosts = _cached_active_hosts(network_base)
+    if known_hosts is not None:
+        print(f"♻️  Reutilizando {len(known_hosts)} hosts activos del último barrido")
+    else:
+        known_hosts = await asyncio.to_thread(_arp_sweep, network_base)
+        if known_hosts is not None:
+            print(f"📶 Barrido ARP: {len(known_hosts)} hosts respondieron")
+    pinger = IcmpPinger.create() if known_hosts is None else None
+    probe_semaphore = asyncio.Semaphore(MAX_RTSP_PROBES)
+    if av is None:
+        # Consultar la versión de ffprobe una vez, fuera del bucle de eventos
+        await asyncio.to_thread(rtsp_timeout_option)
+    
+    # Los resultados se escriben al terminar cada etapa, ordenados por IP
+    def host_alive(ip):
+        active_hosts.append(ip)
+        tcp_q.put_nowait(ip)
+    
+    async def ping_worker():
+        # Solo sin socket ICMP: un proceso ping por IP
+        while True:
+            ip = await ping_q.get()
+            try:
+                if await ping_host_async(ip):
+                    host_alive(ip)
+            finally:
+                ping_q.task_done()
+    
+    async def tcp_worker():
+        while True:
+            ip = await tcp_q.get()
+            try:
+                reply = await probe_rtsp_describe_async(ip)
+                if reply is None:
+                    continue
+                rtsp_cameras.append(ip)
+                status = _rtsp_status(reply)
+                # Server (y el realm si hay 401) identifican al fabricante en cualquier respuesta
+                vendor = _detect_vendor(reply) if status is not None else None
+                if status == 200:
+                    # El stream raíz se entrega sin autenticación: no hace falta ffprobe
+                    working_urls[ip] = f"rtsp://{ip}:554/"
+                elif status is not None:
+                    # Requiere credenciales (401) o habla RTSP pero no en la
+                    # ruta raíz (ej: 404): probar las URLs candidatas
+                    rtsp_q.put_nowait((ip, vendor))
+                else:
+                    working_urls[ip] = None
+            finally:
+                tcp_q.task_done()
+    
+    async def rtsp_worker():
+        while True:
+            ip, vendor = await rtsp_q.get()
+            try:
+                working_urls[ip] = await test_rtsp_connection_async(
+                    ip, vendor=vendor, semaphore=probe_semaphore,
+                    executor=probe_executor)
+            finally:
+                rtsp_q.task_done()
+    
+    # Pool propio para PyAV: al salir se descartan las pruebas en cola sin
+    # esperar a las que siguen en av.open
+    probe_executor = (ThreadPoolExecutor(MAX_RTSP_PROBES, thread_name_prefix='rtsp-probe')
+                      if av is not None else None)
+    workers = ([asyncio.create_task(tcp_worker()) for _ in range(TCP_WORKERS)] +
+               [asyncio.create_task(rtsp_worker()) for _ in range(RTSP_WORKERS)])
+    if known_hosts is None and pinger is None:
+        for ip in ips:
+            ping_q.put_nowait(ip)
+        workers += [asyncio.create_task(ping_worker()) for _ in range(MAX_PING_PROCESSES)]
+    
+    try:
+        # Cada etapa solo recibe trabajo de la anterior: esperar en orden
+        if known_hosts is not None:
+            # Pasar directo al puerto 554
+            for ip in known_hosts:
+                if ip in ip_order:
+                    host_alive(ip)
+        elif pinger is not None:
+            async for ip in pinger.sweep(ips):
+                host_alive(ip)
+        else:
+            await ping_q.join()
+        active_hosts.sort(key=ip_order.__getitem__)
+        _sweep_cache[network_base] = (time.monotonic(), list(active_hosts))
+        _write_lines(f"✅ {ip} - Host activo" for ip in active_hosts)
+        
+        await tcp_q.join()
+        rtsp_cameras.sort(key=ip_order.__getitem__)
+        _write_lines(f"🎥 {ip} - Puerto RTSP (554) abierto" for ip in rtsp_cameras)
+        
+        await rtsp_q.join()
+        rtsp_log = []
+        for ip in rtsp_cameras:
+            url = working_urls[ip]
+            if url:
+                rtsp_log.append(f"✅ {ip} - Cámara RTSP encontrada!")
+                rtsp_log.append(f"   URL: {url}")
+            else:
+                rtsp_log.append(f"❌ {ip} - Puerto abierto pero no responde RTSP")
+        _write_lines(rtsp_log)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if probe_executor is not None:
+            probe_executor.shutdown(wait=False, cancel_futures=True)
+        if pinger is not None:
+            pinger.close()
+    
+    return active_hosts, rtsp_cameras, working_urls
+
 
 def scan_network():
     """Escanear la red en busca de cámaras RTSP."""
     print("🔍 Escaneando red en busca de cámaras RTSP...")
     print("=" * 60)
     
-    # Obtener IP de la red local
-    import socket
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    try:
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-    except:
-        local_ip = "192.168.0.204"  # IP por defecto
-    finally:
-        s.close()
-    
-    network_base = ".".join(local_ip.split(".")[:-1])
+    network_base = get_network_base()
     print(f"🌐 Escaneando red: {network_base}.x")
     print(f"🔍 Buscando cámaras RTSP en puerto 554...")
     print("-" * 60)
     
-    active_hosts = []
-    rtsp_cameras = []
-    
-    # Escanear hosts activos
-    print("📡 Fase 1: Buscando hosts activos...")
-    with ThreadPoolExecutor(max_workers=50) as executor:
-        futures = {executor.submit(ping_host, f"{network_base}.{i}"): i for i in range(1, 255)}
-        
-        for future in futures:
-            ip_num = futures[future]
-            if future.result():
-                ip = f"{network_base}.{ip_num}"
-                active_hosts.append(ip)
-                print(f"✅ {ip} - Host activo")
-    
-    print(f"\n📊 Encontrados {len(active_hosts)} hosts activos")
-    
-    # Probar puertos RTSP
-    print("\n📡 Fase 2: Probando puertos RTSP...")
-    for ip in active_hosts:
-        if test_rtsp_port(ip):
-            print(f"🎥 {ip} - Puerto RTSP (554) abierto")
-            rtsp_cameras.append(ip)
-    
-    # Probar conexiones RTSP
-    print("\n📡 Fase 3: Probando conexiones RTSP...")
-    for ip in rtsp_cameras:
-        print(f"🔍 Probando {ip}...")
-        working_url = test_rtsp_connection(ip)
-        if working_url:
-            print(f"✅ {ip} - Cámara RTSP encontrada!")
-            print(f"   URL: {working_url}")
-        else:
-            print(f"❌ {ip} - Puerto abierto pero no responde RTSP")
+    # Fases 1-3 encadenadas: hosts activos -> puertos RTSP -> conexiones RTSP
+    print("📡 Buscando hosts activos, puertos RTSP y conexiones RTSP...")
+    active_hosts, rtsp_cameras, working_urls = asyncio.run(scan_pipeline(network_base))
     
     print("\n" + "=" * 60)
     print("📊 RESUMEN DEL ESCANEO")
     print("=" * 60)
     print(f"🌐 Red escaneada: {network_base}.x")
     print(f"📡 Hosts activos: {len(active_hosts)}")
-    print(f"🎥 Cámaras RTSP: {len([ip for ip in rtsp_cameras if test_rtsp_connection(ip)])}")
+    print(f"🎥 Cámaras RTSP: {sum(1 for url in working_urls.values() if url)}")
     
     if active_hosts:
         print(f"\n📋 HOSTS ACTIVOS:")
@@ -130,7 +734,7 @@ def scan_network():
     if rtsp_cameras:
         print(f"\n🎥 CÁMARAS RTSP ENCONTRADAS:")
         for ip in rtsp_cameras:
-            working_url = test_rtsp_connection(ip)
+            working_url = working_urls.get(ip)
             if working_url:
                 print(f"   • {ip} - {working_url}")
             else:
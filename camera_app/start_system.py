@@ -16,8 +16,8 @@ Autor: Sistema de Vigilancia RTSP
 Fecha: 2024
 """
 
+import asyncio
 import subprocess
-import threading
 import time
 import signal
 import sys
@@ -25,6 +25,12 @@ import argparse
 import os
 from pathlib import Path
 
+from cleaner import RecordingCleaner
+
+CLEANER_INTERVAL = 3600  # Segundos entre limpiezas automáticas
+STATUS_INTERVAL = 300  # Segundos entre mensajes de estado
+POLL_INTERVAL = 30     # Segundos entre verificaciones si no hay SIGCHLD (Windows)
+
 
 class SystemManager:
     """Gestor principal del sistema de vigilancia."""
@@ -32,45 +38,97 @@ class SystemManager:
     def __init__(self):
         """Inicializar el gestor del sistema."""
         self.processes = {}
+        self._pid_to_name = {}  # PID -> nombre, para identificar hijos recogidos
         self.running = True
-        
-        # Configurar manejo de señales
-        signal.signal(signal.SIGINT, self._signal_handler)
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        self._base_dir = Path(__file__).resolve().parent
+        self._config_path = self._base_dir / "config.json"
+        self._stop_event = None  # asyncio.Event, creado dentro de run()
+        self._tasks = []  # Tareas de fondo: limpieza, estado, verificación
     
-    def _signal_handler(self, signum, frame):
+    def _request_stop(self):
         """Manejar señales de cierre del sistema."""
         print("\n🛑 Recibida señal de cierre. Deteniendo sistema...")
         self.running = False
-        self.stop_all_processes()
-        sys.exit(0)
+        self._stop_event.set()
+    
+    def _reap(self):
+        """Recoger los procesos hijos terminados (llamado al recibir SIGCHLD)."""
+        while True:
+            try:
+                exited = self._next_exited()
+            except ChildProcessError:
+                return  # No quedan hijos
+            if exited is None:
+                return  # Los demás hijos siguen vivos
+            pid, returncode = exited
+            name = self._pid_to_name.pop(pid, None)
+            if name is None:
+                continue  # No es un componente (o ya se estaba deteniendo)
+            process = self.processes.pop(name)
+            process.returncode = returncode
+            print(f"⚠️  {name} se detuvo inesperadamente")
     
-    def start_process(self, name, command, args=None):
+    @staticmethod
+    def _next_exited():
         """
-        Iniciar un proceso en segundo plano.
+        Recoger un hijo terminado sin bloquear.
+        
+        os.waitid solo existe en Linux y otros POSIX (en macOS desde Python
+        3.13); donde falta se usa os.waitpid, disponible en todo POSIX.
+        
+        Returns:
+            tuple: (PID, código de salida, negativo si murió por señal),
+                o None si ningún hijo ha terminado
+            
+        Raises:
+            ChildProcessError: Si no quedan hijos
+        """
+        if hasattr(os, 'waitid'):
+            info = os.waitid(os.P_ALL, 0, os.WEXITED | os.WNOHANG)
+            if info is None:
+                return None
+            if info.si_code == os.CLD_EXITED:
+                return info.si_pid, info.si_status
+            return info.si_pid, -info.si_status  # Terminado por señal
+        pid, status = os.waitpid(-1, os.WNOHANG)
+        if pid == 0:
+            return None
+        return pid, os.waitstatus_to_exitcode(status)
+    
+    def start_process(self, name, script):
+        """
+        Iniciar un script de Python en segundo plano.
+        
+        En POSIX el hijo abre su propia sesión, así la detención alcanza a
+        todo su grupo de procesos (ej: los FFmpeg del grabador).
         
         Args:
             name (str): Nombre del proceso
-            command (str): Comando a ejecutar
-            args (list): Argumentos adicionales
+            script (str): Script relativo al directorio de la aplicación
         """
+        script_path = self._base_dir / script
+        if not script_path.exists():
+            print(f"❌ Error: No se encontró {script_path}")
+            return
+        
         try:
-            cmd = [command] + (args or [])
             print(f"🚀 Iniciando {name}...")
             
             process = subprocess.Popen(
-                cmd,
+                [sys.executable, str(script_path)],
+                cwd=self._base_dir,
+                stdin=subprocess.DEVNULL,
                 stdout=None,  # No capturar stdout para evitar bloqueos
                 stderr=None,  # No capturar stderr para evitar bloqueos
-                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0
+                start_new_session=(os.name != 'nt'),
+                creationflags=subprocess.CREATE_NEW_PROCESS_GROUP if os.name == 'nt' else 0,
+                close_fds=True
             )
             
             self.processes[name] = process
+            self._pid_to_name[process.pid] = name
             print(f"✅ {name} iniciado - PID: {process.pid}")
             
-        except FileNotFoundError:
-            print(f"❌ Error: No se encontró el comando {command}")
-            print(f"💡 Asegúrate de que Python esté instalado y en el PATH")
         except Exception as e:
             print(f"❌ Error iniciando {name}: {e}")
     
@@ -80,12 +138,33 @@ class SystemManager:
             process = self.processes[name]
             if process.poll() is None:
                 print(f"🛑 Deteniendo {name} (PID: {process.pid})")
-                process.terminate()
+                self._signal_process(process)
                 try:
                     process.wait(timeout=10)
                 except subprocess.TimeoutExpired:
-                    process.kill()
+                    self._signal_process(process, force=True)
             del self.processes[name]
+            self._pid_to_name.pop(process.pid, None)
+    
+    def _signal_process(self, process, force=False):
+        """
+        Terminar un hijo junto con todo su grupo de procesos.
+        
+        Args:
+            process (subprocess.Popen): Proceso hijo
+            force (bool): Si es True, matar en lugar de pedir terminar
+        """
+        if os.name == 'nt':
+            if force:
+                process.kill()
+            else:
+                process.terminate()
+            return
+        try:
+            # El PID del hijo es también el ID de su grupo (start_new_session)
+            os.killpg(process.pid, signal.SIGKILL if force else signal.SIGTERM)
+        except ProcessLookupError:
+            pass  # Ya terminó
     
     def stop_all_processes(self):
         """Detener todos los procesos activos."""
@@ -98,23 +177,51 @@ class SystemManager:
             if process.poll() is not None:
                 print(f"⚠️  {name} se detuvo inesperadamente")
                 del self.processes[name]
+                self._pid_to_name.pop(process.pid, None)
+    
+    async def _poll_processes(self):
+        """Verificar procesos periódicamente donde no existe SIGCHLD."""
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            self.check_processes()
+    
+    async def _status_printer(self):
+        """Mostrar el estado del sistema periódicamente."""
+        # Plazo monotónico fijo: los mensajes no se desplazan con el tiempo de impresión
+        loop = asyncio.get_running_loop()
+        next_status = loop.time() + STATUS_INTERVAL
+        while True:
+            await asyncio.sleep(next_status - loop.time())
+            next_status += STATUS_INTERVAL
+            active_count = len(self.processes)
+            print(f"📊 Estado: {active_count} componentes activos - {time.strftime('%H:%M:%S')}")
+    
+    def _run_cleaner(self):
+        """Ejecutar una pasada de limpieza dentro de este proceso."""
+        # Una instancia por pasada: la fecha de corte se calcula al crearla
+        # Rutas relativas al directorio del script, igual que los hijos (cwd=_base_dir)
+        RecordingCleaner(self._config_path, base_dir=self._base_dir).run()
     
-    def run_cleaner_periodically(self):
-        """Ejecutar limpieza periódicamente en un hilo separado."""
+    async def run_cleaner_periodically(self):
+        """Ejecutar limpieza periódicamente sin bloquear el bucle de eventos."""
         while self.running:
+            await asyncio.sleep(CLEANER_INTERVAL)
+            if not self.running:
+                break
+            print("🧹 Ejecutando limpieza automática...")
             try:
-                time.sleep(3600)  # Esperar 1 hora
-                if self.running:
-                    print("🧹 Ejecutando limpieza automática...")
-                    subprocess.run([sys.executable, "cleaner.py"], 
-                                 stdout=None, stderr=None)
-            except Exception as e:
+                await asyncio.to_thread(self._run_cleaner)
+            except (Exception, SystemExit) as e:
+                # RecordingCleaner llama a sys.exit() si falla la configuración
                 print(f"❌ Error en limpieza automática: {e}")
     
-    def run(self, start_recorder=True, start_web=True, start_cleaner=True):
+    async def run(self, start_recorder=True, start_web=True, start_cleaner=True):
         """
         Ejecutar el sistema completo.
         
+        En POSIX el gestor duerme hasta que un hijo termina (SIGCHLD) o llega
+        una señal de cierre, en lugar de despertar cada pocos segundos.
+        
         Args:
             start_recorder (bool): Iniciar grabación
             start_web (bool): Iniciar servidor web
@@ -123,43 +230,45 @@ class SystemManager:
         print("🎥 Sistema de Vigilancia RTSP")
         print("=" * 50)
         
-        # Verificar que estamos en el directorio correcto
-        if not Path("config.json").exists():
-            print("❌ Error: No se encontró config.json")
-            print("💡 Asegúrate de ejecutar este script desde el directorio camera_app")
+        # Verificar la configuración junto al script, no en el directorio actual
+        if not self._config_path.exists():
+            print(f"❌ Error: No se encontró {self._config_path}")
             return
         
+        loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        if os.name != 'nt':
+            # Registrar antes de lanzar procesos para no perder ningún SIGCHLD
+            loop.add_signal_handler(signal.SIGCHLD, self._reap)
+            loop.add_signal_handler(signal.SIGINT, self._request_stop)
+            loop.add_signal_handler(signal.SIGTERM, self._request_stop)
+        
         # Iniciar componentes según configuración
         if start_recorder:
-            self.start_process("Grabador", sys.executable, ["recorder.py"])
+            self.start_process("Grabador", "recorder.py")
         
         if start_web:
-            self.start_process("Servidor Web", sys.executable, ["app.py"])
+            self.start_process("Servidor Web", "app.py")
         
         if start_cleaner:
-            # Iniciar limpieza en hilo separado
-            cleaner_thread = threading.Thread(target=self.run_cleaner_periodically, daemon=True)
-            cleaner_thread.start()
+            self._tasks.append(asyncio.create_task(self.run_cleaner_periodically()))
             print("✅ Limpieza automática programada")
         
         print(f"\n📊 Sistema iniciado con {len(self.processes)} componentes activos")
         print("💡 Presiona Ctrl+C para detener todo el sistema")
         print("=" * 50)
         
-        # Bucle principal de monitoreo
+        # Monitoreo: todas las tareas comparten el bucle y se cancelan juntas
+        self._tasks.append(asyncio.create_task(self._status_printer()))
+        if os.name == 'nt':
+            self._tasks.append(asyncio.create_task(self._poll_processes()))
         try:
-            while self.running:
-                time.sleep(30)  # Verificar cada 30 segundos
-                self.check_processes()
-                
-                # Mostrar estado cada 5 minutos
-                if int(time.time()) % 300 == 0:
-                    active_count = len(self.processes)
-                    print(f"📊 Estado: {active_count} componentes activos - {time.strftime('%H:%M:%S')}")
-        
-        except KeyboardInterrupt:
-            print("\n🛑 Interrupción del usuario")
+            await self._stop_event.wait()
         finally:
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks.clear()
             self.stop_all_processes()
             print("✅ Sistema detenido completamente")
 
@@ -178,11 +287,14 @@ def main():
     
     try:
         manager = SystemManager()
-        manager.run(
+        asyncio.run(manager.run(
             start_recorder=not args.no_recorder,
             start_web=not args.no_web,
             start_cleaner=not args.no_cleaner
-        )
+        ))
+    except KeyboardInterrupt:
+        # Windows: Ctrl+C cancela run(), que ya detuvo los procesos
+        print("\n🛑 Interrupción del usuario")
     except Exception as e:
         print(f"❌ Error fatal: {e}")
         sys.exit(1)
@@ -14,6 +14,62 @@ document.addEventListener('DOMContentLoaded', function() {
     // Obtener todos los contenedores de cámara
     const cameraContainers = document.querySelectorAll('.camera-container');
     
+    // Streams activos por imagen (WebSocket o MJPEG)
+    const activeStreams = new Map();
+    let focusStream = null;
+    
+    // Conectar una imagen al stream de una cámara: WebSocket binario si el
+    // servidor lo soporta, MJPEG (/video_feed) como alternativa
+    function attachStream(img, cameraId) {
+        const stream = {
+            ws: null,
+            blobUrl: null,
+            closed: false,
+            close() {
+                this.closed = true;
+                if (this.ws) {
+                    this.ws.close();
+                }
+                if (this.blobUrl) {
+                    URL.revokeObjectURL(this.blobUrl);
+                    this.blobUrl = null;
+                }
+                img.src = '';
+            }
+        };
+        
+        const useMjpeg = () => {
+            if (!stream.closed) {
+                img.src = `/video_feed/${cameraId}`;
+            }
+        };
+        
+        if (!('WebSocket' in window)) {
+            useMjpeg();
+            return stream;
+        }
+        
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        const ws = new WebSocket(`${protocol}//${window.location.host}/ws_feed/${cameraId}`);
+        ws.binaryType = 'blob';
+        
+        ws.addEventListener('message', function(event) {
+            // Cada mensaje es un JPEG completo
+            const url = URL.createObjectURL(event.data);
+            img.src = url;
+            if (stream.blobUrl) {
+                URL.revokeObjectURL(stream.blobUrl);
+            }
+            stream.blobUrl = url;
+        });
+        
+        // Si el WebSocket no está disponible o se cierra, volver a MJPEG
+        ws.addEventListener('close', useMjpeg);
+        
+        stream.ws = ws;
+        return stream;
+    }
+    
     // Añadir event listeners a cada cámara
     cameraContainers.forEach(container => {
         container.addEventListener('click', function() {
@@ -23,7 +79,7 @@ document.addEventListener('DOMContentLoaded', function() {
             
             if (streamImg && streamImg.src) {
                 // Cambiar a vista de enfoque
-                showFocusView(streamImg.src, cameraName, cameraId);
+                showFocusView(cameraName, cameraId);
             }
         });
         
@@ -64,9 +120,12 @@ document.addEventListener('DOMContentLoaded', function() {
     });
     
     // Función para mostrar vista de enfoque
-    function showFocusView(streamUrl, cameraName, cameraId) {
+    function showFocusView(cameraName, cameraId) {
         // Actualizar elementos de la vista de enfoque
-        focusImage.src = streamUrl;
+        if (focusStream) {
+            focusStream.close();
+        }
+        focusStream = attachStream(focusImage, cameraId);
         focusTitle.textContent = cameraName;
         focusSubtitle.textContent = `ID: ${cameraId}`;
         
@@ -107,8 +166,11 @@ document.addEventListener('DOMContentLoaded', function() {
             focusView.style.opacity = '';
             focusView.style.transform = '';
             
-            // Limpiar la imagen para liberar memoria
-            focusImage.src = '';
+            // Cerrar el stream para liberar conexión y memoria
+            if (focusStream) {
+                focusStream.close();
+                focusStream = null;
+            }
         }, 300);
         
         console.log('Vuelto a vista de cuadrícula');
@@ -139,15 +201,16 @@ document.addEventListener('DOMContentLoaded', function() {
             }
             this.style.display = 'block';
         });
+        
+        activeStreams.set(stream, attachStream(stream, stream.dataset.cameraId));
     });
     
     // Función para actualizar streams (útil para debugging)
     function refreshAllStreams() {
         cameraStreams.forEach(stream => {
-            const originalSrc = stream.src;
-            stream.src = '';
+            activeStreams.get(stream).close();
             setTimeout(() => {
-                stream.src = originalSrc + '?t=' + Date.now();
+                activeStreams.set(stream, attachStream(stream, stream.dataset.cameraId));
             }, 100);
         });
         console.log('Todos los streams actualizados');